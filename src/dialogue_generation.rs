@@ -1,12 +1,132 @@
-use reqwest::Client;
-use serde::Deserialize;
+//! # Dialogue Generation Module
+//!
+//! This module sends NPC prompts to the Groq chat completions API and parses the responses.
+//!
+//! By default all requests share one pooled HTTP client. Pooled connections are bound to the
+//! Tokio runtime that opened them, so applications that run several runtimes (for example one per
+//! `#[tokio::test]`) should give each runtime its own client from `new_client` and run their
+//! requests inside `with_client`.
+
+use bytes::Bytes;
+use reqwest::multipart::{Form, Part};
+use reqwest::{Client, RequestBuilder, Response, StatusCode};
+use serde::{Deserialize, Serialize};
+use serde_json::value::RawValue;
+use std::borrow::Cow;
+use std::collections::{BTreeMap, HashMap};
 use std::env;
+use std::future::Future;
+use std::sync::{Arc, Mutex, OnceLock};
+use std::time::Duration;
+use tokio::sync::{Semaphore, SemaphorePermit};
+use tokio::task::JoinSet;
+
+/// Maximum number of requests allowed in flight at once when generating concurrently.
+const MAX_CONCURRENT_REQUESTS: usize = 8;
+
+/// Maximum number of times a rate-limited or transiently failing request is retried.
+const MAX_RETRIES: u32 = 3;
+
+/// Longest time to wait before retrying a request.
+const MAX_RETRY_DELAY: Duration = Duration::from_secs(60);
+
+/// Limits in-flight chat requests across every caller and entry point, so they share one quota.
+static REQUEST_PERMITS: Semaphore = Semaphore::const_new(MAX_CONCURRENT_REQUESTS);
+
+/// Base URL of the OpenAI-compatible Groq API.
+const API_BASE_URL: &str = "https://api.groq.com/openai/v1";
+
+/// How often the status of a submitted batch job is polled.
+const BATCH_POLL_INTERVAL: Duration = Duration::from_secs(30);
+
+/// The model used for every chat completion.
+const MODEL: &str = "llama3-8b-8192";
+
+/// Number of responses a `ResponseCache` keeps by default.
+pub const DEFAULT_CACHE_CAPACITY: usize = 256;
+
+/// Maximum number of tool-call round trips before giving up on a response.
+const MAX_TOOL_ROUNDS: usize = 4;
+
+/// How long an idle pooled connection is kept open for reuse.
+const POOL_IDLE_TIMEOUT: Duration = Duration::from_secs(90);
+
+/// Interval between TCP keepalive probes on open connections.
+const TCP_KEEPALIVE: Duration = Duration::from_secs(60);
+
+/// The HTTP client shared by every request, so connections are pooled across calls.
+static CLIENT: OnceLock<Client> = OnceLock::new();
+
+tokio::task_local! {
+    /// The client installed by `with_client` for the current task, used instead of `CLIENT`.
+    static CLIENT_OVERRIDE: Client;
+}
+
+/// Error type used internally so failures can cross task boundaries.
+type SendError = Box<dyn std::error::Error + Send + Sync>;
 
 /// Represents a message in the choices array from the API response.
 #[derive(Deserialize, Debug)]
 pub struct ChoiceMessage {
     pub role: String,
-    pub content: String,
+    pub content: Option<String>, // Null when the model only requests tool calls
+    #[serde(default)]
+    pub tool_calls: Option<Vec<ToolCall>>,
+}
+
+/// Represents a tool call requested by the model.
+#[derive(Serialize, Deserialize, Debug, Clone)]
+pub struct ToolCall {
+    pub id: String,
+    #[serde(rename = "type")]
+    pub kind: String,
+    pub function: FunctionCall,
+}
+
+/// Represents the function name and JSON-encoded arguments of a tool call.
+#[derive(Serialize, Deserialize, Debug, Clone)]
+pub struct FunctionCall {
+    pub name: String,
+    pub arguments: String,
+}
+
+/// Describes a function the model may call to look up NPC details on demand.
+#[derive(Serialize, Debug, Clone)]
+pub struct ToolDefinition {
+    pub name: String,
+    pub description: String,
+    /// JSON schema of the function's arguments.
+    pub parameters: serde_json::Value,
+}
+
+impl ToolDefinition {
+    /// Creates a new tool definition.
+    ///
+    /// # Arguments
+    ///
+    /// * `name` - The function name the model uses to call the tool.
+    /// * `description` - What the tool returns, so the model knows when to call it.
+    /// * `parameters` - A JSON schema describing the function's arguments.
+    ///
+    /// # Examples
+    ///
+    /// ```
+    /// use athena::dialogue_generation::ToolDefinition;
+    ///
+    /// let tool = ToolDefinition::new(
+    ///     "get_npc_history",
+    ///     "Returns the NPC's backstory.",
+    ///     serde_json::json!({ "type": "object", "properties": {} }),
+    /// );
+    /// assert_eq!(tool.name, "get_npc_history");
+    /// ```
+    pub fn new(name: &str, description: &str, parameters: serde_json::Value) -> Self {
+        ToolDefinition {
+            name: name.to_string(),
+            description: description.to_string(),
+            parameters,
+        }
+    }
 }
 
 /// Represents a choice from the API response.
@@ -28,6 +148,39 @@ pub struct Usage {
     pub completion_time: f64,
     pub total_tokens: usize,
     pub total_time: f64,
+    /// Breakdown of prompt tokens, reported when the provider serves part of the prompt from its cache.
+    #[serde(default)]
+    pub prompt_tokens_details: Option<PromptTokensDetails>,
+}
+
+/// Represents the prompt token breakdown from the API response.
+#[derive(Deserialize, Debug)]
+pub struct PromptTokensDetails {
+    #[serde(default)]
+    pub cached_tokens: usize,
+}
+
+impl Usage {
+    /// Returns the number of prompt tokens that were served from the provider's prompt cache.
+    ///
+    /// # Examples
+    ///
+    /// ```
+    /// use athena::dialogue_generation::Usage;
+    ///
+    /// let usage: Usage = serde_json::from_str(r#"{
+    ///     "queue_time": 0.01, "prompt_tokens": 120, "prompt_time": 0.02,
+    ///     "completion_tokens": 30, "completion_time": 0.05,
+    ///     "total_tokens": 150, "total_time": 0.07,
+    ///     "prompt_tokens_details": { "cached_tokens": 100 }
+    /// }"#).unwrap();
+    /// assert_eq!(usage.cached_prompt_tokens(), 100);
+    /// ```
+    pub fn cached_prompt_tokens(&self) -> usize {
+        self.prompt_tokens_details
+            .as_ref()
+            .map_or(0, |details| details.cached_tokens)
+    }
 }
 
 /// Represents the complete response from the API.
@@ -43,6 +196,524 @@ pub struct ApiResponse {
     pub x_groq: serde_json::Value, // Assuming this can vary, so use Value
 }
 
+/// Represents the per-request response recorded in a batch output file.
+#[derive(Deserialize, Debug)]
+pub struct BatchResponse {
+    pub status_code: u16,
+    pub request_id: String,
+    pub body: serde_json::Value, // Either an ApiResponse or an error object, depending on status_code
+}
+
+/// Represents one line of a batch job's output or error file.
+#[derive(Deserialize, Debug)]
+pub struct BatchOutput {
+    pub id: String,
+    pub custom_id: String,
+    pub response: Option<BatchResponse>,
+    pub error: Option<serde_json::Value>,
+}
+
+impl BatchOutput {
+    /// Converts the batch output into the API response it carries.
+    ///
+    /// # Returns
+    ///
+    /// * `Result<ApiResponse, Box<dyn std::error::Error>>` - The API response, or an error if the request failed.
+    ///
+    /// # Examples
+    ///
+    /// ```
+    /// use athena::dialogue_generation::BatchOutput;
+    ///
+    /// let output: BatchOutput = serde_json::from_str(r#"{
+    ///     "id": "batch_req_1", "custom_id": "request-0",
+    ///     "response": { "status_code": 429, "request_id": "req_1", "body": { "error": "rate limited" } },
+    ///     "error": null
+    /// }"#).unwrap();
+    /// assert!(output.into_api_response().is_err());
+    /// ```
+    pub fn into_api_response(self) -> Result<ApiResponse, Box<dyn std::error::Error>> {
+        match self.response {
+            Some(response) if response.status_code == 200 => Ok(serde_json::from_value(response.body)?),
+            Some(response) => Err(format!(
+                "Batch request {} failed with status: {} - {}",
+                self.custom_id, response.status_code, response.body
+            )
+            .into()),
+            None => Err(format!(
+                "Batch request {} failed: {}",
+                self.custom_id,
+                self.error.unwrap_or(serde_json::Value::Null)
+            )
+            .into()),
+        }
+    }
+}
+
+/// An in-memory cache of chat completion responses.
+///
+/// Entries are keyed by the exact context and instruction strings and hold the raw response
+/// body bytes. Each context is stored once however many instructions are cached for it. When
+/// the cache is full, the least recently used response is evicted. The cache is safe to share
+/// between concurrent requests.
+pub struct ResponseCache {
+    /// The maximum number of responses kept.
+    capacity: usize,
+    /// The cached responses and their recency.
+    state: Mutex<CacheState>,
+}
+
+/// The mutable contents of a `ResponseCache`.
+struct CacheState {
+    /// Cached responses, grouped by context and keyed by instruction.
+    entries: HashMap<Arc<str>, HashMap<Arc<str>, CacheEntry>>,
+    /// The key of every cached response, ordered from least to most recently used.
+    recency: BTreeMap<u64, (Arc<str>, Arc<str>)>,
+    /// A counter advanced on every access, used to order `recency`.
+    clock: u64,
+}
+
+/// A cached response body and when it was last used.
+struct CacheEntry {
+    body: Bytes,
+    last_used: u64,
+}
+
+impl ResponseCache {
+    /// Creates a new empty response cache holding up to `DEFAULT_CACHE_CAPACITY` responses.
+    ///
+    /// # Examples
+    ///
+    /// ```
+    /// use athena::dialogue_generation::ResponseCache;
+    /// let cache = ResponseCache::new();
+    /// assert!(cache.is_empty());
+    /// ```
+    pub fn new() -> Self {
+        ResponseCache::with_capacity(DEFAULT_CACHE_CAPACITY)
+    }
+
+    /// Creates a new empty response cache holding up to `capacity` responses.
+    ///
+    /// # Arguments
+    ///
+    /// * `capacity` - The maximum number of responses to keep. A capacity of 0 disables caching.
+    ///
+    /// # Examples
+    ///
+    /// ```
+    /// use athena::dialogue_generation::ResponseCache;
+    /// let cache = ResponseCache::with_capacity(32);
+    /// assert_eq!(cache.capacity(), 32);
+    /// ```
+    pub fn with_capacity(capacity: usize) -> Self {
+        ResponseCache {
+            capacity,
+            state: Mutex::new(CacheState {
+                entries: HashMap::new(),
+                recency: BTreeMap::new(),
+                clock: 0,
+            }),
+        }
+    }
+
+    /// Returns the maximum number of responses the cache keeps.
+    pub fn capacity(&self) -> usize {
+        self.capacity
+    }
+
+    /// Returns the number of cached responses.
+    ///
+    /// # Examples
+    ///
+    /// ```
+    /// use athena::dialogue_generation::ResponseCache;
+    /// let cache = ResponseCache::new();
+    /// assert_eq!(cache.len(), 0);
+    /// ```
+    pub fn len(&self) -> usize {
+        self.state.lock().unwrap().recency.len()
+    }
+
+    /// Returns `true` if the cache holds no responses.
+    pub fn is_empty(&self) -> bool {
+        self.len() == 0
+    }
+
+    /// Removes every cached response.
+    pub fn clear(&self) {
+        let mut state = self.state.lock().unwrap();
+        state.entries.clear();
+        state.recency.clear();
+    }
+
+    /// Looks up a cached response body, marking it as recently used.
+    fn get(&self, context: &str, instruction: &str) -> Option<Bytes> {
+        let mut state = self.state.lock().unwrap();
+        state.clock += 1;
+        let clock = state.clock;
+        let entry = state.entries.get_mut(context)?.get_mut(instruction)?;
+        let last_used = std::mem::replace(&mut entry.last_used, clock);
+        let body = entry.body.clone();
+        state.touch(last_used, clock);
+        Some(body)
+    }
+
+    /// Stores a response body, evicting the least recently used one if the cache is full.
+    fn insert(&self, context: &str, instruction: &str, body: Bytes) {
+        if self.capacity == 0 {
+            return;
+        }
+
+        let mut state = self.state.lock().unwrap();
+        state.clock += 1;
+        let clock = state.clock;
+
+        // Replace an existing response in place
+        if let Some(entry) = state
+            .entries
+            .get_mut(context)
+            .and_then(|instructions| instructions.get_mut(instruction))
+        {
+            let last_used = std::mem::replace(&mut entry.last_used, clock);
+            entry.body = body;
+            state.touch(last_used, clock);
+            return;
+        }
+
+        if state.recency.len() >= self.capacity {
+            state.evict_least_recently_used();
+        }
+
+        // Share one copy of the context between its entries and the recency index
+        let context: Arc<str> = match state.entries.get_key_value(context) {
+            Some((context, _)) => context.clone(),
+            None => Arc::from(context),
+        };
+        let instruction: Arc<str> = Arc::from(instruction);
+        state.recency.insert(clock, (context.clone(), instruction.clone()));
+        state
+            .entries
+            .entry(context)
+            .or_default()
+            .insert(instruction, CacheEntry { body, last_used: clock });
+    }
+}
+
+impl CacheState {
+    /// Moves an entry in the recency index from `last_used` to `now`.
+    fn touch(&mut self, last_used: u64, now: u64) {
+        if let Some(key) = self.recency.remove(&last_used) {
+            self.recency.insert(now, key);
+        }
+    }
+
+    /// Removes the entry that was used least recently.
+    fn evict_least_recently_used(&mut self) {
+        if let Some((_, (context, instruction))) = self.recency.pop_first() {
+            if let Some(instructions) = self.entries.get_mut(&context) {
+                instructions.remove(&instruction);
+                if instructions.is_empty() {
+                    self.entries.remove(&context);
+                }
+            }
+        }
+    }
+}
+
+/// An NPC context serialized once into its system message, ready to reuse across requests.
+///
+/// Games typically run many turns for the same NPC with an unchanged context. Preparing the
+/// context up front means each turn only serializes its own instruction, instead of escaping and
+/// encoding the whole context again for every request and retry.
+///
+/// Cloning is cheap: clones share the same text and serialized message.
+#[derive(Debug, Clone)]
+pub struct PreparedContext {
+    /// The original context text.
+    text: Arc<str>,
+    /// The serialized system message.
+    message: Arc<RawValue>,
+}
+
+impl PreparedContext {
+    /// Serializes the shared NPC context into a reusable system message.
+    ///
+    /// # Arguments
+    ///
+    /// * `context` - A string slice that holds the shared NPC context.
+    ///
+    /// # Examples
+    ///
+    /// ```
+    /// use athena::dialogue_generation::PreparedContext;
+    /// let context = PreparedContext::new("You are Aria, a cheerful blacksmith.");
+    /// assert_eq!(context.as_str(), "You are Aria, a cheerful blacksmith.");
+    /// ```
+    pub fn new(context: &str) -> Self {
+        let message = serde_json::value::to_raw_value(&RequestMessage::new("system", context))
+            .expect("Failed to serialize context");
+        PreparedContext {
+            text: Arc::from(context),
+            message: Arc::from(message),
+        }
+    }
+
+    /// Returns the context text.
+    pub fn as_str(&self) -> &str {
+        &self.text
+    }
+}
+
+/// The shared NPC context of a request, either as plain text or already prepared.
+///
+/// Every `send_*` function accepts anything convertible into an `NpcContext`, so a string slice
+/// and a `PreparedContext` can be used interchangeably.
+///
+/// # Examples
+///
+/// ```
+/// use athena::dialogue_generation::{NpcContext, PreparedContext};
+///
+/// let prepared = PreparedContext::new("You are Aria, a cheerful blacksmith.");
+/// let from_text = NpcContext::from("You are Aria, a cheerful blacksmith.");
+/// let from_prepared = NpcContext::from(&prepared);
+/// assert_eq!(from_text.as_str(), from_prepared.as_str());
+/// ```
+#[derive(Debug, Clone, Copy)]
+pub enum NpcContext<'a> {
+    /// Context text, serialized with each request.
+    Text(&'a str),
+    /// Context serialized ahead of time by `PreparedContext::new`.
+    Prepared(&'a PreparedContext),
+}
+
+impl<'a> NpcContext<'a> {
+    /// Returns the context text.
+    pub fn as_str(&self) -> &'a str {
+        match *self {
+            NpcContext::Text(text) => text,
+            NpcContext::Prepared(prepared) => prepared.as_str(),
+        }
+    }
+
+    /// Returns an owned prepared form of the context, serializing it if needed.
+    fn to_prepared(self) -> PreparedContext {
+        match self {
+            NpcContext::Text(text) => PreparedContext::new(text),
+            NpcContext::Prepared(prepared) => prepared.clone(),
+        }
+    }
+}
+
+impl<'a> From<&'a str> for NpcContext<'a> {
+    fn from(text: &'a str) -> Self {
+        NpcContext::Text(text)
+    }
+}
+
+impl<'a> From<&'a String> for NpcContext<'a> {
+    fn from(text: &'a String) -> Self {
+        NpcContext::Text(text)
+    }
+}
+
+impl<'a> From<&'a PreparedContext> for NpcContext<'a> {
+    fn from(prepared: &'a PreparedContext) -> Self {
+        NpcContext::Prepared(prepared)
+    }
+}
+
+/// Represents an entry in the messages array of a chat completion request.
+#[derive(Serialize, Debug)]
+#[serde(untagged)]
+enum RequestEntry<'a> {
+    /// A message serialized ahead of time.
+    Prepared(&'a RawValue),
+    /// A message serialized with the request.
+    Message(RequestMessage<'a>),
+}
+
+impl<'a> From<RequestMessage<'a>> for RequestEntry<'a> {
+    fn from(message: RequestMessage<'a>) -> Self {
+        RequestEntry::Message(message)
+    }
+}
+
+/// Represents a message in a chat completion request.
+///
+/// Borrows its content so the shared NPC context is never copied per request.
+#[derive(Serialize, Debug)]
+struct RequestMessage<'a> {
+    role: &'static str,
+    content: Option<Cow<'a, str>>,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    tool_calls: Option<Vec<ToolCall>>,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    tool_call_id: Option<String>,
+}
+
+impl<'a> RequestMessage<'a> {
+    /// Creates a plain message with borrowed content.
+    fn new(role: &'static str, content: &'a str) -> Self {
+        RequestMessage {
+            role,
+            content: Some(Cow::Borrowed(content)),
+            tool_calls: None,
+            tool_call_id: None,
+        }
+    }
+}
+
+/// Represents a tool offered to the model in a chat completion request.
+#[derive(Serialize, Debug)]
+struct RequestTool<'a> {
+    #[serde(rename = "type")]
+    kind: &'static str,
+    function: &'a ToolDefinition,
+}
+
+/// Represents the body of a chat completion request.
+#[derive(Serialize, Debug)]
+struct ChatRequest<'a> {
+    messages: Vec<RequestEntry<'a>>,
+    model: &'static str,
+    #[serde(skip_serializing_if = "Vec::is_empty")]
+    tools: Vec<RequestTool<'a>>,
+    #[serde(skip_serializing_if = "std::ops::Not::not")]
+    stream: bool,
+}
+
+/// Represents one line of a batch job's input file.
+#[derive(Serialize, Debug)]
+struct BatchInputLine<'a> {
+    custom_id: String,
+    method: &'static str,
+    url: &'static str,
+    body: ChatRequest<'a>,
+}
+
+/// Represents one server-sent event of a streamed chat completion.
+#[derive(Deserialize, Debug)]
+struct StreamChunk {
+    #[serde(default)]
+    choices: Vec<StreamChoice>,
+    /// Set instead of `choices` when the stream fails part-way through.
+    #[serde(default)]
+    error: Option<serde_json::Value>,
+}
+
+/// Represents a choice within a streamed chunk.
+#[derive(Deserialize, Debug)]
+struct StreamChoice {
+    delta: StreamDelta,
+}
+
+/// Represents the incremental content of a streamed choice.
+#[derive(Deserialize, Debug)]
+struct StreamDelta {
+    #[serde(default)]
+    content: Option<String>,
+}
+
+/// Incrementally parses the server-sent events of a streamed chat completion.
+///
+/// Events are newline-delimited, and a network chunk may end part-way through a line (or a
+/// UTF-8 character), so incomplete lines are buffered until the rest arrives. Comment lines
+/// such as `: keepalive` and other non-`data:` fields are ignored.
+struct StreamParser {
+    /// Bytes of the current, not yet complete line.
+    buffer: Vec<u8>,
+    /// Whether the `[DONE]` event has been seen.
+    done: bool,
+}
+
+impl StreamParser {
+    /// Creates a parser at the start of a stream.
+    fn new() -> Self {
+        StreamParser {
+            buffer: Vec::new(),
+            done: false,
+        }
+    }
+
+    /// Parses a chunk of the stream, calling `on_delta` for each piece of generated text.
+    ///
+    /// # Returns
+    ///
+    /// `true` once the `[DONE]` event has been seen, or an error if the stream reported one.
+    fn feed<F>(&mut self, chunk: &[u8], on_delta: &mut F) -> Result<bool, SendError>
+    where
+        F: FnMut(&str),
+    {
+        if self.done {
+            return Ok(true);
+        }
+        self.buffer.extend_from_slice(chunk);
+
+        // Parse every complete line straight from the buffer, then drop them in one go
+        let mut start = 0;
+        let result = loop {
+            let offset = match self.buffer[start..].iter().position(|&byte| byte == b'\n') {
+                Some(offset) => offset,
+                None => break Ok(false),
+            };
+            let line = self.buffer[start..start + offset].trim_ascii();
+            start += offset + 1;
+            let data = match line.strip_prefix(b"data:") {
+                Some(data) => data.trim_ascii(),
+                None => continue,
+            };
+            if data == b"[DONE]" {
+                self.done = true;
+                break Ok(true);
+            }
+
+            let event: StreamChunk = match serde_json::from_slice(data) {
+                Ok(event) => event,
+                Err(e) => break Err(e.into()),
+            };
+            if let Some(error) = event.error {
+                let message = error
+                    .get("message")
+                    .and_then(|message| message.as_str())
+                    .map_or_else(|| error.to_string(), str::to_string);
+                break Err(format!("Stream failed: {}", message).into());
+            }
+            for choice in event.choices {
+                if let Some(delta) = choice.delta.content {
+                    on_delta(&delta);
+                }
+            }
+        };
+        self.buffer.drain(..start);
+        result
+    }
+
+    /// Parses whatever is left once the stream has ended, in case the last line had no newline.
+    fn finish<F>(&mut self, on_delta: &mut F) -> Result<(), SendError>
+    where
+        F: FnMut(&str),
+    {
+        self.feed(b"\n", on_delta).map(|_| ())
+    }
+}
+
+/// Represents an uploaded file returned by the files endpoint.
+#[derive(Deserialize, Debug)]
+struct FileObject {
+    id: String,
+}
+
+/// Represents the state of a batch job returned by the batches endpoint.
+#[derive(Deserialize, Debug)]
+struct BatchJob {
+    id: String,
+    status: String,
+    output_file_id: Option<String>,
+    error_file_id: Option<String>,
+}
+
 /// Sends a message to the API and returns the JSON response.
 ///
 /// # Arguments
@@ -53,37 +724,810 @@ pub struct ApiResponse {
 ///
 /// * `Result<ApiResponse, Box<dyn std::error::Error>>` - A result containing the API response or an error.
 pub async fn send_message(input: &str) -> Result<ApiResponse, Box<dyn std::error::Error>> {
-    let client = Client::new();
-    let api_key = env::var("GROQ_API_KEY").expect("GROQ_API_KEY not set");
-
-    // Create request body
-    let request_body = serde_json::json!({
-        "messages": [
-            {
-                "role": "user",
-                "content": input
+    post_chat_completion(&build_request(None, input))
+        .await
+        .map_err(|e| e as Box<dyn std::error::Error>)
+}
+
+/// Sends a task instruction together with the shared NPC context and returns the JSON response.
+///
+/// The context (personality, state, emotions, knowledge) is sent once as the system message,
+/// so the user message only has to carry the task instruction itself. Callers generating
+/// several pieces of dialogue for the same NPC should pass the same context to every call
+/// instead of repeating it inside each instruction.
+///
+/// The system message always comes first and the instruction last, so requests for the same
+/// NPC share an identical prompt prefix that the provider can serve from its prompt cache.
+/// Keep the context byte-for-byte stable between calls (no timestamps or per-call values) to
+/// get cache hits; `Usage::cached_prompt_tokens` reports how much of the prompt was reused.
+///
+/// # Arguments
+///
+/// * `context` - The shared NPC context, as a string slice or a `PreparedContext`.
+/// * `instruction` - A string slice that holds the task instruction.
+///
+/// # Returns
+///
+/// * `Result<ApiResponse, Box<dyn std::error::Error>>` - A result containing the API response or an error.
+pub async fn send_message_with_context<'a>(
+    context: impl Into<NpcContext<'a>>,
+    instruction: &str,
+) -> Result<ApiResponse, Box<dyn std::error::Error>> {
+    post_chat_completion(&build_request(Some(context.into()), instruction))
+        .await
+        .map_err(|e| e as Box<dyn std::error::Error>)
+}
+
+/// Sends a task instruction with the shared NPC context and streams the response as it is generated.
+///
+/// `on_delta` is called with each piece of text as soon as it arrives, so a game loop can start
+/// showing dialogue after the first tokens instead of waiting for the whole completion.
+///
+/// # Arguments
+///
+/// * `context` - The shared NPC context, as a string slice or a `PreparedContext`.
+/// * `instruction` - A string slice that holds the task instruction.
+/// * `on_delta` - Called with each piece of generated text, in order.
+///
+/// # Returns
+///
+/// * `Result<String, Box<dyn std::error::Error>>` - The complete generated text, or an error.
+pub async fn stream_message_with_context<'a, F>(
+    context: impl Into<NpcContext<'a>>,
+    instruction: &str,
+    mut on_delta: F,
+) -> Result<String, Box<dyn std::error::Error>>
+where
+    F: FnMut(&str),
+{
+    let mut request = build_request(Some(context.into()), instruction);
+    request.stream = true;
+
+    // Hold the permit until the stream ends, since the request is in flight until then
+    let (mut response, _permit) = send_chat_request(&request)
+        .await
+        .map_err(|e| e as Box<dyn std::error::Error>)?;
+    if !response.status().is_success() {
+        return Err(error_from_response(response).await);
+    }
+
+    let mut parser = StreamParser::new();
+    let mut content = String::new();
+    let mut handle_delta = |delta: &str| {
+        on_delta(delta);
+        content.push_str(delta);
+    };
+    while let Some(chunk) = response.chunk().await? {
+        let done = parser
+            .feed(&chunk, &mut handle_delta)
+            .map_err(|e| e as Box<dyn std::error::Error>)?;
+        if done {
+            return Ok(content);
+        }
+    }
+    parser
+        .finish(&mut handle_delta)
+        .map_err(|e| e as Box<dyn std::error::Error>)?;
+    Ok(content)
+}
+
+/// Sends a task instruction with the shared NPC context, reusing a cached response when possible.
+///
+/// Responses are cached by context and instruction, so re-triggering the same NPC with
+/// the same prompt is answered from memory instead of the API. Use `send_message_with_context`
+/// to always request a fresh response.
+///
+/// # Arguments
+///
+/// * `cache` - The cache to look up and store responses in.
+/// * `context` - The shared NPC context, as a string slice or a `PreparedContext`.
+/// * `instruction` - A string slice that holds the task instruction.
+///
+/// # Returns
+///
+/// * `Result<ApiResponse, Box<dyn std::error::Error>>` - A result containing the API response or an error.
+pub async fn send_cached_message_with_context<'a>(
+    cache: &ResponseCache,
+    context: impl Into<NpcContext<'a>>,
+    instruction: &str,
+) -> Result<ApiResponse, Box<dyn std::error::Error>> {
+    let context = context.into();
+    if let Some(body) = cache.get(context.as_str(), instruction) {
+        return Ok(serde_json::from_slice(&body)?);
+    }
+
+    let body = fetch_chat_completion_body(&build_request(Some(context), instruction))
+        .await
+        .map_err(|e| e as Box<dyn std::error::Error>)?;
+    let api_response: ApiResponse = serde_json::from_slice(&body)?;
+    cache.insert(context.as_str(), instruction, body);
+    Ok(api_response)
+}
+
+/// Sends a task instruction with a minimal NPC context, letting the model fetch extra details via tools.
+///
+/// Rather than packing every detail about the NPC (history, relationships, motivations) into the
+/// context on every call, keep the context to what each turn needs and expose the rest as tools.
+/// Whenever the model requests tool calls, `call_tool` is invoked for each one (typically looking
+/// the answer up in the NPC's knowledge graph or memory) and the results are sent back, until the
+/// model returns a final response or `MAX_TOOL_ROUNDS` round trips have been made.
+///
+/// # Arguments
+///
+/// * `context` - The core NPC context, as a string slice or a `PreparedContext`.
+/// * `instruction` - A string slice that holds the task instruction.
+/// * `tools` - The tools the model may call.
+/// * `call_tool` - Resolves a tool call to the text returned to the model.
+///
+/// # Returns
+///
+/// * `Result<ApiResponse, Box<dyn std::error::Error>>` - A result containing the final API response or an error.
+pub async fn send_message_with_tools<'a, F>(
+    context: impl Into<NpcContext<'a>>,
+    instruction: &str,
+    tools: &[ToolDefinition],
+    mut call_tool: F,
+) -> Result<ApiResponse, Box<dyn std::error::Error>>
+where
+    F: FnMut(&ToolCall) -> String,
+{
+    let mut request = build_request(Some(context.into()), instruction);
+    request.tools = tools
+        .iter()
+        .map(|function| RequestTool {
+            kind: "function",
+            function,
+        })
+        .collect();
+
+    for _ in 0..MAX_TOOL_ROUNDS {
+        let response = post_chat_completion(&request)
+            .await
+            .map_err(|e| e as Box<dyn std::error::Error>)?;
+
+        let message = match response.choices.first() {
+            Some(choice) => &choice.message,
+            None => return Ok(response),
+        };
+        let tool_calls = match &message.tool_calls {
+            Some(tool_calls) if !tool_calls.is_empty() => tool_calls.clone(),
+            _ => return Ok(response),
+        };
+
+        // Answer each tool call, then send the conversation back to the model
+        let results: Vec<RequestEntry> = tool_calls
+            .iter()
+            .map(|tool_call| {
+                RequestMessage {
+                    role: "tool",
+                    content: Some(Cow::Owned(call_tool(tool_call))),
+                    tool_calls: None,
+                    tool_call_id: Some(tool_call.id.clone()),
+                }
+                .into()
+            })
+            .collect();
+        request.messages.push(
+            RequestMessage {
+                role: "assistant",
+                content: message.content.clone().map(Cow::Owned),
+                tool_calls: Some(tool_calls),
+                tool_call_id: None,
             }
-        ],
-        "model": "llama3-8b-8192"
-    });
+            .into(),
+        );
+        request.messages.extend(results);
+    }
+
+    Err(format!("No final response after {} tool-call rounds", MAX_TOOL_ROUNDS).into())
+}
+
+/// Sends several task instructions for the same NPC context concurrently.
+///
+/// Each instruction becomes its own request sharing the same system context. At most
+/// `MAX_CONCURRENT_REQUESTS` chat requests are in flight at once across all callers, and
+/// rate-limited requests are retried with backoff. If any request fails, the remaining ones
+/// are cancelled. The context is serialized once and shared between the spawned tasks
+/// rather than copied into each one. The spawned tasks use the same client as the caller.
+/// Must be called from within a Tokio runtime.
+///
+/// # Arguments
+///
+/// * `context` - The shared NPC context, as a string slice or a `PreparedContext`.
+/// * `instructions` - The task instructions to generate responses for.
+///
+/// # Returns
+///
+/// * `Result<Vec<ApiResponse>, Box<dyn std::error::Error>>` - The responses, in the same order as
+///   `instructions`, or the first error encountered.
+pub async fn send_messages_with_context<'a>(
+    context: impl Into<NpcContext<'a>>,
+    instructions: &[&str],
+) -> Result<Vec<ApiResponse>, Box<dyn std::error::Error>> {
+    let context = context.into().to_prepared();
+    let client = client();
+
+    // Task-locals are not inherited by spawned tasks, so carry the caller's client into each one
+    let mut tasks = JoinSet::new();
+    for (index, instruction) in instructions.iter().enumerate() {
+        let context = context.clone();
+        let instruction = instruction.to_string();
+        tasks.spawn(CLIENT_OVERRIDE.scope(client.clone(), async move {
+            let request = build_request(Some(NpcContext::Prepared(&context)), &instruction);
+            let response = post_chat_completion(&request).await?;
+            Ok::<_, SendError>((index, response))
+        }));
+    }
+
+    // Returning early drops the JoinSet, which aborts every task still running
+    let mut responses: Vec<Option<ApiResponse>> = instructions.iter().map(|_| None).collect();
+    while let Some(joined) = tasks.join_next().await {
+        let (index, response) = joined?.map_err(|e| e as Box<dyn std::error::Error>)?;
+        responses[index] = Some(response);
+    }
+    Ok(responses.into_iter().flatten().collect())
+}
+
+/// Generates responses for many (context, instruction) pairs as a single offline batch job.
+///
+/// Intended for bulk workloads such as populating a world with NPC dialogue, where latency
+/// does not matter but cost and throughput do. All prompts are uploaded as one JSONL file,
+/// submitted as one batch job, and polled every `BATCH_POLL_INTERVAL` until the job finishes.
+/// This is `submit_batch_with_context` followed by `collect_batch`; call those directly to keep
+/// the batch ID, for example to resume collecting after a restart. Interactive callers should
+/// keep using `send_message_with_context`.
+///
+/// # Arguments
+///
+/// * `prompts` - Pairs of shared NPC context (a string slice or a `PreparedContext`) and task
+///   instruction, one per request.
+///
+/// # Returns
+///
+/// * `Result<Vec<Option<BatchOutput>>, Box<dyn std::error::Error>>` - One entry per prompt, in the
+///   same order as `prompts`, or an error if the job could not be submitted or did not complete.
+///   An entry is `None` when the job ended (for example by expiring) before that prompt ran.
+///   Errors raised after submission name the batch ID, so the job can be collected later.
+pub async fn send_batch_with_context<'a, C>(
+    prompts: &[(C, &str)],
+) -> Result<Vec<Option<BatchOutput>>, Box<dyn std::error::Error>>
+where
+    C: Into<NpcContext<'a>> + Copy,
+{
+    let batch_id = submit_batch_with_context(prompts).await?;
+    collect_batch(&batch_id, prompts.len()).await
+}
+
+/// Uploads (context, instruction) pairs and submits them as one batch job.
+///
+/// # Arguments
+///
+/// * `prompts` - Pairs of shared NPC context (a string slice or a `PreparedContext`) and task
+///   instruction, one per request.
+///
+/// # Returns
+///
+/// * `Result<String, Box<dyn std::error::Error>>` - The ID of the submitted batch, to pass to
+///   `collect_batch`, or an error if the job could not be submitted.
+pub async fn submit_batch_with_context<'a, C>(
+    prompts: &[(C, &str)],
+) -> Result<String, Box<dyn std::error::Error>>
+where
+    C: Into<NpcContext<'a>> + Copy,
+{
+    submit_batch(prompts)
+        .await
+        .map_err(|e| e as Box<dyn std::error::Error>)
+}
 
-    // Send request to the API
+/// Waits for a submitted batch job to finish and downloads its results.
+///
+/// Transient failures while polling or downloading (rate limits, server errors, dropped
+/// connections) are retried. If collecting still fails, the error names the batch ID; the job
+/// keeps running on the server, so `collect_batch` can simply be called again.
+///
+/// # Arguments
+///
+/// * `batch_id` - The ID returned by `submit_batch_with_context`.
+/// * `prompt_count` - The number of prompts that were submitted.
+///
+/// # Returns
+///
+/// * `Result<Vec<Option<BatchOutput>>, Box<dyn std::error::Error>>` - One entry per prompt, in
+///   submission order, with `None` for prompts the job did not run.
+pub async fn collect_batch(
+    batch_id: &str,
+    prompt_count: usize,
+) -> Result<Vec<Option<BatchOutput>>, Box<dyn std::error::Error>> {
+    collect_batch_outputs(batch_id, prompt_count)
+        .await
+        .map_err(|e| format!("Batch {} could not be collected: {}", batch_id, e).into())
+}
+
+/// Uploads the batch input file and creates the batch job.
+///
+/// # Arguments
+///
+/// * `prompts` - Pairs of shared NPC context and task instruction, one per request.
+async fn submit_batch<'a, C>(prompts: &[(C, &str)]) -> Result<String, SendError>
+where
+    C: Into<NpcContext<'a>> + Copy,
+{
+    let client = client();
+    let api_key = api_key();
+
+    // Write one request per line, using the prompt index as the custom ID
+    let mut input_file = Vec::new();
+    for (index, (context, instruction)) in prompts.iter().enumerate() {
+        let line = BatchInputLine {
+            custom_id: format!("request-{}", index),
+            method: "POST",
+            url: "/v1/chat/completions",
+            body: build_request(Some((*context).into()), instruction),
+        };
+        serde_json::to_writer(&mut input_file, &line)?;
+        input_file.push(b'\n');
+    }
+
+    // Upload the input file
+    let form = Form::new().text("purpose", "batch").part(
+        "file",
+        Part::bytes(input_file)
+            .file_name("batch_input.jsonl")
+            .mime_str("application/jsonl")?,
+    );
     let response = client
-        .post("https://api.groq.com/openai/v1/chat/completions")
+        .post(format!("{}/files", API_BASE_URL))
         .header("Authorization", format!("Bearer {}", api_key))
-        .header("Content-Type", "application/json")
-        .json(&request_body)
+        .multipart(form)
         .send()
         .await?;
+    let file: FileObject = parse_response(response).await?;
+
+    // Submit the batch job
+    let response = client
+        .post(format!("{}/batches", API_BASE_URL))
+        .header("Authorization", format!("Bearer {}", api_key))
+        .json(&serde_json::json!({
+            "input_file_id": file.id,
+            "endpoint": "/v1/chat/completions",
+            "completion_window": "24h"
+        }))
+        .send()
+        .await?;
+    let job: BatchJob = parse_response(response).await?;
+    Ok(job.id)
+}
+
+/// Polls a batch job until it finishes, then downloads and orders its outputs.
+///
+/// # Arguments
+///
+/// * `batch_id` - The ID of the batch job.
+/// * `prompt_count` - The number of prompts that were submitted.
+async fn collect_batch_outputs(
+    batch_id: &str,
+    prompt_count: usize,
+) -> Result<Vec<Option<BatchOutput>>, SendError> {
+    let client = client();
+    let api_key = api_key();
+
+    // Poll until the job reaches a terminal state
+    let mut job: BatchJob = loop {
+        let response = send_with_retry(|| {
+            client
+                .get(format!("{}/batches/{}", API_BASE_URL, batch_id))
+                .header("Authorization", format!("Bearer {}", api_key))
+        })
+        .await?;
+        let job: BatchJob = parse_response(response).await?;
+        if matches!(job.status.as_str(), "completed" | "failed" | "expired" | "cancelled") {
+            break job;
+        }
+        tokio::time::sleep(BATCH_POLL_INTERVAL).await;
+    };
+
+    if job.output_file_id.is_none() && job.error_file_id.is_none() {
+        return Err(format!("Job ended with status: {}", job.status).into());
+    }
+
+    // Collect successful and failed requests from the output and error files
+    let mut outputs: Vec<Option<BatchOutput>> = (0..prompt_count).map(|_| None).collect();
+    let file_ids: Vec<String> = job.output_file_id.take().into_iter().chain(job.error_file_id.take()).collect();
+    for file_id in file_ids {
+        let response = send_with_retry(|| {
+            client
+                .get(format!("{}/files/{}/content", API_BASE_URL, file_id))
+                .header("Authorization", format!("Bearer {}", api_key))
+        })
+        .await?;
+        if !response.status().is_success() {
+            return Err(error_from_response(response).await);
+        }
+        let body = response.bytes().await?;
+        for line in body.split(|&byte| byte == b'\n') {
+            let line = line.trim_ascii();
+            if line.is_empty() {
+                continue;
+            }
+
+            // Place each output by the index in its custom ID, so missing lines cannot shift others
+            let output: BatchOutput = serde_json::from_slice(line)?;
+            let slot = output
+                .custom_id
+                .strip_prefix("request-")
+                .and_then(|index| index.parse::<usize>().ok())
+                .and_then(|index| outputs.get_mut(index))
+                .ok_or_else(|| format!("Unexpected custom ID: {}", output.custom_id))?;
+            *slot = Some(output);
+        }
+    }
+
+    Ok(outputs)
+}
+
+/// Builds the chat completion request.
+///
+/// A prepared context is spliced in as already serialized JSON; plain text is serialized
+/// with the request. Both produce identical bytes.
+///
+/// # Arguments
+///
+/// * `context` - An optional shared context, sent as the system message.
+/// * `input` - The user message.
+fn build_request<'a>(context: Option<NpcContext<'a>>, input: &'a str) -> ChatRequest<'a> {
+    let mut messages = Vec::with_capacity(2);
+    match context {
+        Some(NpcContext::Text(text)) => messages.push(RequestMessage::new("system", text).into()),
+        Some(NpcContext::Prepared(prepared)) => messages.push(RequestEntry::Prepared(&prepared.message)),
+        None => {}
+    }
+    messages.push(RequestMessage::new("user", input).into());
+
+    ChatRequest {
+        messages,
+        model: MODEL,
+        tools: Vec::new(),
+        stream: false,
+    }
+}
+
+/// Posts a request to the chat completions endpoint and parses the response.
+///
+/// # Arguments
+///
+/// * `request` - The request to send.
+async fn post_chat_completion(request: &ChatRequest<'_>) -> Result<ApiResponse, SendError> {
+    let (response, _permit) = send_chat_request(request).await?;
+    parse_response(response).await
+}
+
+/// Posts a request to the chat completions endpoint and returns the raw response body.
+///
+/// The body is kept as the `Bytes` buffer reqwest received, parsed with
+/// `serde_json::from_slice` and stored in the cache without decoding it as text or copying it.
+///
+/// # Arguments
+///
+/// * `request` - The request to send.
+async fn fetch_chat_completion_body(request: &ChatRequest<'_>) -> Result<Bytes, SendError> {
+    let (response, _permit) = send_chat_request(request).await?;
+    if !response.status().is_success() {
+        return Err(error_from_response(response).await);
+    }
+    Ok(response.bytes().await?)
+}
+
+/// Sends a request to the chat completions endpoint.
+///
+/// Waits for one of the `REQUEST_PERMITS` first and returns it with the response; keep it
+/// until the body has been read so the request counts against the shared limit while in flight.
+/// Transient failures are retried as described in `send_with_retry`.
+///
+/// # Arguments
+///
+/// * `request` - The request to send.
+async fn send_chat_request(
+    request: &ChatRequest<'_>,
+) -> Result<(Response, SemaphorePermit<'static>), SendError> {
+    let permit = REQUEST_PERMITS.acquire().await?;
+    let client = client();
+    let api_key = api_key();
+
+    let response = send_with_retry(|| {
+        client
+            .post(format!("{}/chat/completions", API_BASE_URL))
+            .header("Authorization", format!("Bearer {}", api_key))
+            .header("Content-Type", "application/json")
+            .json(request)
+    })
+    .await?;
+    Ok((response, permit))
+}
 
+/// Sends a request, retrying transient failures.
+///
+/// Rate-limited (HTTP 429) and server-error (HTTP 5xx) responses, as well as connection and
+/// timeout errors, are retried up to `MAX_RETRIES` times. The wait honours the `retry-after`
+/// header when present and backs off exponentially otherwise, never longer than
+/// `MAX_RETRY_DELAY`. Once retries run out, the last response is returned as-is.
+///
+/// # Arguments
+///
+/// * `build` - Builds a fresh request for each attempt.
+async fn send_with_retry<F>(build: F) -> Result<Response, SendError>
+where
+    F: Fn() -> RequestBuilder,
+{
+    let mut attempt = 0;
+    loop {
+        let retry_after = match build().send().await {
+            Ok(response) => {
+                let status = response.status();
+                let transient = status == StatusCode::TOO_MANY_REQUESTS || status.is_server_error();
+                if !transient || attempt >= MAX_RETRIES {
+                    return Ok(response);
+                }
+
+                // Negative, NaN or infinite values fall back to backoff instead of panicking
+                response
+                    .headers()
+                    .get("retry-after")
+                    .and_then(|value| value.to_str().ok())
+                    .and_then(|value| value.parse::<f64>().ok())
+                    .and_then(|seconds| Duration::try_from_secs_f64(seconds).ok())
+            }
+            Err(e) if (e.is_connect() || e.is_timeout()) && attempt < MAX_RETRIES => None,
+            Err(e) => return Err(e.into()),
+        };
+
+        let delay = retry_after
+            .unwrap_or_else(|| Duration::from_secs(1 << attempt))
+            .min(MAX_RETRY_DELAY);
+        tokio::time::sleep(delay).await;
+        attempt += 1;
+    }
+}
+
+/// Builds an HTTP client configured for the Groq API.
+///
+/// Connections are pooled and kept alive between requests instead of paying a new TCP/TLS
+/// handshake for every call. HTTP/2 is offered via ALPN (the `native-tls-alpn` feature), so
+/// concurrent requests are multiplexed over one connection when the server accepts it.
+///
+/// Pooled connections belong to the Tokio runtime that opened them. Applications that run
+/// several runtimes should build one client per runtime and pass it to `with_client`.
+///
+/// # Returns
+///
+/// * `Client` - A new client with its own connection pool.
+///
+/// # Examples
+///
+/// ```
+/// use athena::dialogue_generation::new_client;
+///
+/// let client = new_client();
+/// ```
+pub fn new_client() -> Client {
+    Client::builder()
+        .pool_idle_timeout(POOL_IDLE_TIMEOUT)
+        .pool_max_idle_per_host(MAX_CONCURRENT_REQUESTS)
+        .tcp_keepalive(TCP_KEEPALIVE)
+        .build()
+        .expect("Failed to build HTTP client")
+}
+
+/// Runs a future with every request it makes sent through the given client.
+///
+/// Without this, requests use one client shared by the whole process. Use it to keep a
+/// separate connection pool per Tokio runtime, or to supply a client with custom settings.
+///
+/// # Arguments
+///
+/// * `client` - The client to send requests with, typically from `new_client`.
+/// * `future` - The future to run, for example a call to `send_message_with_context`.
+///
+/// # Returns
+///
+/// * `F::Output` - The output of `future`.
+///
+/// # Examples
+///
+/// ```
+/// use athena::dialogue_generation::{new_client, with_client};
+///
+/// let runtime = tokio::runtime::Runtime::new().unwrap();
+/// let answer = runtime.block_on(with_client(new_client(), async { 42 }));
+/// assert_eq!(answer, 42);
+/// ```
+pub async fn with_client<F: Future>(client: Client, future: F) -> F::Output {
+    CLIENT_OVERRIDE.scope(client, future).await
+}
+
+/// Returns the client for the current task: the one set by `with_client`, or else the shared
+/// client, created on first use. Cloning a `Client` only clones a handle to its pool.
+fn client() -> Client {
+    CLIENT_OVERRIDE
+        .try_with(Client::clone)
+        .unwrap_or_else(|_| CLIENT.get_or_init(new_client).clone())
+}
+
+/// Reads the API key from the `GROQ_API_KEY` environment variable.
+fn api_key() -> String {
+    env::var("GROQ_API_KEY").expect("GROQ_API_KEY not set")
+}
+
+/// Deserializes a successful response body, or turns a non-successful response into an error.
+///
+/// # Arguments
+///
+/// * `response` - The HTTP response to read.
+async fn parse_response<T: serde::de::DeserializeOwned>(response: Response) -> Result<T, SendError> {
     // Check if the response is successful
     if response.status().is_success() {
-        let json_response: ApiResponse = response.json().await?;
-        Ok(json_response)
+        Ok(response.json().await?)
     } else {
-        // Handle non-successful responses
-        let status = response.status();
-        let error_message = response.text().await.unwrap_or_else(|_| "Failed to read error message".to_string());
-        Err(format!("Request failed with status: {} - {}", status, error_message).into())
+        Err(error_from_response(response).await)
+    }
+}
+
+/// Builds an error describing a non-successful response.
+///
+/// # Arguments
+///
+/// * `response` - The HTTP response to describe.
+async fn error_from_response(response: Response) -> SendError {
+    let status = response.status();
+    let error_message = response.text().await.unwrap_or_else(|_| "Failed to read error message".to_string());
+    format!("Request failed with status: {} - {}", status, error_message).into()
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn prepared_context_serializes_like_text_context() {
+        let text = "You are Aria, a \"cheerful\" blacksmith.\nShe hums while working. ☺";
+        let prepared = PreparedContext::new(text);
+
+        let from_text = serde_json::to_vec(&build_request(Some(NpcContext::Text(text)), "Greet the player")).unwrap();
+        let from_prepared =
+            serde_json::to_vec(&build_request(Some(NpcContext::Prepared(&prepared)), "Greet the player")).unwrap();
+        assert_eq!(from_text, from_prepared);
+    }
+
+    #[test]
+    fn entry_points_accept_text_and_prepared_contexts() {
+        let prepared = PreparedContext::new("context");
+        let text = String::from("context");
+        let cache = ResponseCache::new();
+
+        // Only build the futures; nothing is sent until they are awaited
+        drop(send_message_with_context("context", "greet"));
+        drop(send_message_with_context(&text, "greet"));
+        drop(send_message_with_context(&prepared, "greet"));
+        drop(send_cached_message_with_context(&cache, &prepared, "greet"));
+        drop(stream_message_with_context(&prepared, "greet", |_| {}));
+        drop(send_message_with_tools(&prepared, "greet", &[], |_| String::new()));
+        drop(send_messages_with_context(&prepared, &["greet"]));
+        drop(send_batch_with_context(&[("context", "greet")]));
+        drop(send_batch_with_context(&[(&prepared, "greet")]));
+        drop(submit_batch_with_context(&[(&prepared, "greet")]));
+        drop(collect_batch("batch_1", 1));
+    }
+
+    #[test]
+    fn response_cache_evicts_least_recently_used() {
+        let cache = ResponseCache::with_capacity(2);
+        cache.insert("context", "a", Bytes::from_static(b"a"));
+        cache.insert("context", "b", Bytes::from_static(b"b"));
+        assert!(cache.get("context", "a").is_some());
+
+        cache.insert("context", "c", Bytes::from_static(b"c"));
+        assert_eq!(cache.len(), 2);
+        assert!(cache.get("context", "a").is_some());
+        assert!(cache.get("context", "b").is_none());
+        assert!(cache.get("context", "c").is_some());
+    }
+
+    #[test]
+    fn response_cache_keys_on_exact_strings() {
+        let cache = ResponseCache::new();
+        cache.insert("context", "greet", Bytes::from_static(b"hello"));
+        cache.insert("context", "greet", Bytes::from_static(b"hi"));
+        assert_eq!(cache.len(), 1);
+        assert_eq!(&*cache.get("context", "greet").unwrap(), b"hi");
+        assert!(cache.get("other context", "greet").is_none());
+        assert!(cache.get("context", "greet ").is_none());
+    }
+
+    #[test]
+    fn response_cache_overwrite_marks_entry_recently_used() {
+        let cache = ResponseCache::with_capacity(2);
+        cache.insert("context", "a", Bytes::from_static(b"a"));
+        cache.insert("other context", "b", Bytes::from_static(b"b"));
+        cache.insert("context", "a", Bytes::from_static(b"a2"));
+
+        cache.insert("context", "c", Bytes::from_static(b"c"));
+        assert_eq!(cache.len(), 2);
+        assert_eq!(&*cache.get("context", "a").unwrap(), b"a2");
+        assert!(cache.get("other context", "b").is_none());
+        cache.clear();
+        assert!(cache.is_empty());
+    }
+
+    #[test]
+    fn response_cache_with_zero_capacity_stores_nothing() {
+        let cache = ResponseCache::with_capacity(0);
+        cache.insert("context", "greet", Bytes::from_static(b"hello"));
+        assert!(cache.is_empty());
+    }
+
+    /// Feeds each chunk to a fresh parser and returns the collected text and the last result.
+    fn parse_stream(chunks: &[&[u8]]) -> (String, Result<bool, SendError>) {
+        let mut parser = StreamParser::new();
+        let mut text = String::new();
+        let mut result = Ok(false);
+        for chunk in chunks {
+            result = parser.feed(chunk, &mut |delta: &str| text.push_str(delta));
+            if !matches!(result, Ok(false)) {
+                break;
+            }
+        }
+        (text, result)
+    }
+
+    #[test]
+    fn stream_parser_joins_lines_split_across_chunks() {
+        let event = "data: {\"choices\":[{\"delta\":{\"content\":\"Grüß dich\"}}]}\n\n".as_bytes();
+        // Split inside the multi-byte "ü" as well as inside the JSON
+        let (first, rest) = event.split_at(42);
+        let (second, third) = rest.split_at(10);
+        let (text, result) = parse_stream(&[first, second, third]);
+        assert_eq!(text, "Grüß dich");
+        assert!(matches!(result, Ok(false)));
+    }
+
+    #[test]
+    fn stream_parser_stops_at_done() {
+        let (text, result) = parse_stream(&[
+            b"data: {\"choices\":[{\"delta\":{\"content\":\"Hi\"}}]}\n\ndata: [DONE]\n\n",
+            b"data: {\"choices\":[{\"delta\":{\"content\":\" there\"}}]}\n\n",
+        ]);
+        assert_eq!(text, "Hi");
+        assert!(matches!(result, Ok(true)));
+    }
+
+    #[test]
+    fn stream_parser_ignores_keepalive_and_empty_deltas() {
+        let (text, result) = parse_stream(&[
+            b": keepalive\r\n\r\n",
+            b"data: {\"choices\":[{\"delta\":{\"role\":\"assistant\"}}]}\r\n\r\n",
+            b"data: {\"choices\":[{\"delta\":{\"content\":\"Hello\"}}]}\r\n\r\n",
+        ]);
+        assert_eq!(text, "Hello");
+        assert!(matches!(result, Ok(false)));
+    }
+
+    #[test]
+    fn stream_parser_reports_error_events() {
+        let (_, result) = parse_stream(&[b"data: {\"error\":{\"message\":\"model overloaded\"}}\n\n"]);
+        let error = result.unwrap_err();
+        assert_eq!(error.to_string(), "Stream failed: model overloaded");
+    }
+
+    #[test]
+    fn stream_parser_finish_parses_unterminated_last_line() {
+        let mut parser = StreamParser::new();
+        let mut text = String::new();
+        let mut on_delta = |delta: &str| text.push_str(delta);
+        let done = parser
+            .feed(b"data: {\"choices\":[{\"delta\":{\"content\":\"Bye\"}}]}", &mut on_delta)
+            .unwrap();
+        assert!(!done);
+        parser.finish(&mut on_delta).unwrap();
+        assert_eq!(text, "Bye");
     }
 }
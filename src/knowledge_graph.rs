@@ -3,6 +3,10 @@
 //! This module implements a knowledge graph for NPCs, allowing them to store and manage knowledge
 //! about entities, relationships, and properties. The knowledge graph enables NPCs to make informed
 //! decisions based on the information available.
+//!
+//! To keep prompts bounded as an NPC accumulates history, older relationships can be archived:
+//! they stay in the graph for decision-making, but prompts describe them through short summaries
+//! while only the newer relationships are listed verbatim.
 
 use std::collections::HashMap;
 
@@ -77,8 +81,12 @@ impl Relationship {
 pub struct KnowledgeGraph {
     /// A collection of entities in the knowledge graph.
     entities: HashMap<String, Entity>,
-    /// A collection of relationships in the knowledge graph.
+    /// A collection of relationships in the knowledge graph, oldest first.
     relationships: Vec<Relationship>,
+    /// Summaries of archived relationships, oldest first.
+    archive_summaries: Vec<String>,
+    /// The number of relationships, from the start, covered by the archive summaries.
+    archived_count: usize,
 }
 
 impl KnowledgeGraph {
@@ -94,6 +102,8 @@ impl KnowledgeGraph {
         KnowledgeGraph {
             entities: HashMap::new(),
             relationships: Vec::new(),
+            archive_summaries: Vec::new(),
+            archived_count: 0,
         }
     }
 
@@ -195,4 +205,262 @@ impl KnowledgeGraph {
             .filter(|r| r.source == entity_id || r.target == entity_id)
             .collect()
     }
+
+    /// Retrieves the most recently added relationships.
+    ///
+    /// # Arguments
+    ///
+    /// * `limit` - The maximum number of relationships to return.
+    ///
+    /// # Returns
+    ///
+    /// A slice of at most `limit` relationships, oldest first.
+    ///
+    /// # Examples
+    ///
+    /// ```
+    /// use std::collections::HashMap;
+    /// use athena::knowledge_graph::{KnowledgeGraph, Relationship};
+    /// let mut knowledge_graph = KnowledgeGraph::new();
+    /// knowledge_graph.add_relationship(Relationship::new("1".to_string(), "2".to_string(), "friend".to_string(), HashMap::new()));
+    /// knowledge_graph.add_relationship(Relationship::new("1".to_string(), "3".to_string(), "rival".to_string(), HashMap::new()));
+    /// let recent = knowledge_graph.recent_relationships(1);
+    /// assert_eq!(recent[0].relation_type, "rival");
+    /// ```
+    pub fn recent_relationships(&self, limit: usize) -> &[Relationship] {
+        let start = self.relationships.len().saturating_sub(limit);
+        &self.relationships[start..]
+    }
+
+    /// Computes where archiving should stop to keep the most recent relationships verbatim.
+    ///
+    /// Pass the result to both `relationships_to_archive` and `archive_relationships`, so that
+    /// relationships added while the summary is being generated are not archived with it.
+    ///
+    /// # Arguments
+    ///
+    /// * `keep_recent` - The number of most recent relationships to keep verbatim.
+    ///
+    /// # Returns
+    ///
+    /// The index of the first relationship to keep verbatim.
+    ///
+    /// # Examples
+    ///
+    /// ```
+    /// use std::collections::HashMap;
+    /// use athena::knowledge_graph::{KnowledgeGraph, Relationship};
+    /// let mut knowledge_graph = KnowledgeGraph::new();
+    /// knowledge_graph.add_relationship(Relationship::new("1".to_string(), "2".to_string(), "friend".to_string(), HashMap::new()));
+    /// knowledge_graph.add_relationship(Relationship::new("1".to_string(), "3".to_string(), "rival".to_string(), HashMap::new()));
+    /// assert_eq!(knowledge_graph.archive_end(1), 1);
+    /// assert_eq!(knowledge_graph.archive_end(5), 0);
+    /// ```
+    pub fn archive_end(&self, keep_recent: usize) -> usize {
+        self.relationships.len().saturating_sub(keep_recent)
+    }
+
+    /// Retrieves the relationships before `up_to` that have not been summarized yet.
+    ///
+    /// Summarize these (for example with an offline call to
+    /// `dialogue_generation::send_message`) and pass the result, with the same `up_to`, to
+    /// `archive_relationships`.
+    ///
+    /// # Arguments
+    ///
+    /// * `up_to` - The index to archive up to, usually from `archive_end`.
+    ///
+    /// # Returns
+    ///
+    /// A slice of the relationships to summarize, oldest first.
+    ///
+    /// # Examples
+    ///
+    /// ```
+    /// use std::collections::HashMap;
+    /// use athena::knowledge_graph::{KnowledgeGraph, Relationship};
+    /// let mut knowledge_graph = KnowledgeGraph::new();
+    /// knowledge_graph.add_relationship(Relationship::new("1".to_string(), "2".to_string(), "friend".to_string(), HashMap::new()));
+    /// knowledge_graph.add_relationship(Relationship::new("1".to_string(), "3".to_string(), "rival".to_string(), HashMap::new()));
+    /// let to_archive = knowledge_graph.relationships_to_archive(knowledge_graph.archive_end(1));
+    /// assert_eq!(to_archive.len(), 1);
+    /// assert_eq!(to_archive[0].relation_type, "friend");
+    /// ```
+    pub fn relationships_to_archive(&self, up_to: usize) -> &[Relationship] {
+        let end = up_to.min(self.relationships.len());
+        &self.relationships[self.archived_count.min(end)..end]
+    }
+
+    /// Marks the relationships returned by `relationships_to_archive` as summarized.
+    ///
+    /// The relationships stay in the knowledge graph, so `get_relationships` still finds them;
+    /// only `describe` switches to showing them through the summary. Each call adds a new
+    /// summary alongside the earlier ones, so summaries never have to be merged by hand.
+    /// Relationships at or after `up_to` are left unarchived, even if they were added after
+    /// `relationships_to_archive` was called.
+    ///
+    /// # Arguments
+    ///
+    /// * `up_to` - The same index that was passed to `relationships_to_archive`.
+    /// * `summary` - A short summary of the relationships being archived.
+    ///
+    /// # Returns
+    ///
+    /// The number of relationships archived by this call.
+    ///
+    /// # Examples
+    ///
+    /// ```
+    /// use std::collections::HashMap;
+    /// use athena::knowledge_graph::{KnowledgeGraph, Relationship};
+    /// let mut knowledge_graph = KnowledgeGraph::new();
+    /// knowledge_graph.add_relationship(Relationship::new("1".to_string(), "2".to_string(), "friend".to_string(), HashMap::new()));
+    /// knowledge_graph.add_relationship(Relationship::new("1".to_string(), "3".to_string(), "rival".to_string(), HashMap::new()));
+    /// let up_to = knowledge_graph.archive_end(1);
+    /// assert_eq!(knowledge_graph.relationships_to_archive(up_to).len(), 1);
+    /// // A relationship added while the summary is generated stays unarchived
+    /// knowledge_graph.add_relationship(Relationship::new("1".to_string(), "4".to_string(), "mentor".to_string(), HashMap::new()));
+    /// let archived = knowledge_graph.archive_relationships(up_to, "1 and 2 are friends.");
+    /// assert_eq!(archived, 1);
+    /// assert_eq!(knowledge_graph.relationships_to_archive(knowledge_graph.archive_end(0)).len(), 2);
+    /// assert_eq!(knowledge_graph.get_relationships("1").len(), 3);
+    /// ```
+    pub fn archive_relationships(&mut self, up_to: usize, summary: &str) -> usize {
+        let archived = self.relationships_to_archive(up_to).len();
+        if archived > 0 {
+            self.archive_summaries.push(summary.to_string());
+            self.archived_count += archived;
+        }
+        archived
+    }
+
+    /// Replaces all archive summaries with a single combined summary.
+    ///
+    /// Use this once the summaries themselves grow long, after summarizing them into one. Does
+    /// nothing if no relationships have been archived, since there is nothing to summarize.
+    ///
+    /// # Arguments
+    ///
+    /// * `summary` - A summary covering every archived relationship.
+    ///
+    /// # Examples
+    ///
+    /// ```
+    /// use std::collections::HashMap;
+    /// use athena::knowledge_graph::{KnowledgeGraph, Relationship};
+    /// let mut knowledge_graph = KnowledgeGraph::new();
+    /// knowledge_graph.compact_archive_summaries("Nothing has happened yet.");
+    /// assert!(knowledge_graph.get_archive_summaries().is_empty());
+    /// knowledge_graph.add_relationship(Relationship::new("1".to_string(), "2".to_string(), "friend".to_string(), HashMap::new()));
+    /// knowledge_graph.archive_relationships(1, "1 and 2 met.");
+    /// knowledge_graph.add_relationship(Relationship::new("1".to_string(), "3".to_string(), "rival".to_string(), HashMap::new()));
+    /// knowledge_graph.archive_relationships(2, "1 and 3 fell out.");
+    /// knowledge_graph.compact_archive_summaries("1 is friends with 2 and rivals with 3.");
+    /// assert_eq!(knowledge_graph.get_archive_summaries(), ["1 is friends with 2 and rivals with 3."]);
+    /// ```
+    pub fn compact_archive_summaries(&mut self, summary: &str) {
+        if self.archived_count > 0 {
+            self.archive_summaries = vec![summary.to_string()];
+        }
+    }
+
+    /// Gets the summaries of archived relationships.
+    ///
+    /// # Returns
+    ///
+    /// A slice of the summaries, oldest first, which is empty if nothing has been archived.
+    ///
+    /// # Examples
+    ///
+    /// ```
+    /// use std::collections::HashMap;
+    /// use athena::knowledge_graph::{KnowledgeGraph, Relationship};
+    /// let mut knowledge_graph = KnowledgeGraph::new();
+    /// knowledge_graph.add_relationship(Relationship::new("1".to_string(), "2".to_string(), "friend".to_string(), HashMap::new()));
+    /// knowledge_graph.archive_relationships(knowledge_graph.archive_end(0), "1 and 2 are friends.");
+    /// assert_eq!(knowledge_graph.get_archive_summaries(), ["1 and 2 are friends."]);
+    /// ```
+    pub fn get_archive_summaries(&self) -> &[String] {
+        &self.archive_summaries
+    }
+
+    /// Describes the knowledge graph for use in a prompt.
+    ///
+    /// The description lists every entity, then the archive summaries, then the relationships
+    /// that have not been archived yet. Its length stays bounded as long as older relationships
+    /// are archived periodically. Entities and properties are listed in sorted order, so the
+    /// same knowledge always produces the same text.
+    ///
+    /// # Returns
+    ///
+    /// A string describing the knowledge graph.
+    ///
+    /// # Examples
+    ///
+    /// ```
+    /// use std::collections::HashMap;
+    /// use athena::knowledge_graph::{KnowledgeGraph, Entity, Relationship};
+    /// let mut knowledge_graph = KnowledgeGraph::new();
+    /// let mut properties = HashMap::new();
+    /// properties.insert("name".to_string(), "Alice".to_string());
+    /// knowledge_graph.add_entity(Entity::new("1".to_string(), properties));
+    /// knowledge_graph.add_relationship(Relationship::new("1".to_string(), "3".to_string(), "rival".to_string(), HashMap::new()));
+    /// knowledge_graph.archive_relationships(knowledge_graph.archive_end(0), "1 and 3 used to be rivals.");
+    /// let mut properties = HashMap::new();
+    /// properties.insert("since".to_string(), "2021".to_string());
+    /// knowledge_graph.add_relationship(Relationship::new("1".to_string(), "2".to_string(), "friend".to_string(), properties));
+    /// let description = knowledge_graph.describe();
+    /// assert_eq!(
+    ///     description,
+    ///     "Entities:\n- 1 (name: Alice)\nSummary:\n- 1 and 3 used to be rivals.\nRecent:\n- 1 friend 2 (since: 2021)\n"
+    /// );
+    /// ```
+    pub fn describe(&self) -> String {
+        let mut description = String::new();
+
+        let mut entities: Vec<&Entity> = self.entities.values().collect();
+        entities.sort_by(|a, b| a.id.cmp(&b.id));
+        if !entities.is_empty() {
+            description.push_str("Entities:\n");
+        }
+        for entity in entities {
+            description.push_str(&format!("- {}{}\n", entity.id, describe_properties(&entity.properties)));
+        }
+
+        if !self.archive_summaries.is_empty() {
+            description.push_str("Summary:\n");
+        }
+        for summary in &self.archive_summaries {
+            description.push_str(&format!("- {}\n", summary));
+        }
+
+        let recent = &self.relationships[self.archived_count..];
+        if !recent.is_empty() {
+            description.push_str("Recent:\n");
+        }
+        for relationship in recent {
+            description.push_str(&format!(
+                "- {} {} {}{}\n",
+                relationship.source,
+                relationship.relation_type,
+                relationship.target,
+                describe_properties(&relationship.properties)
+            ));
+        }
+        description
+    }
+}
+
+/// Formats properties as ` (key: value, ...)` in key order, or an empty string if there are none.
+fn describe_properties(properties: &HashMap<String, String>) -> String {
+    if properties.is_empty() {
+        return String::new();
+    }
+    let mut properties: Vec<_> = properties.iter().collect();
+    properties.sort();
+    let properties: Vec<String> = properties
+        .iter()
+        .map(|(key, value)| format!("{}: {}", key, value))
+        .collect();
+    format!(" ({})", properties.join(", "))
 }
\ No newline at end of file